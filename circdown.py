@@ -1,41 +1,83 @@
 #!/usr/bin/env python3
 import argparse
+import concurrent.futures
 import datetime
-import humanfriendly
+import email.utils
+import hashlib
 import io
 import os
 import re
-import requests
-import xml.etree.ElementTree as ET
+import shutil
+import string
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import lxml.etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+try:
+    import ciso8601
+except ImportError:
+    ciso8601 = None
 
 DEFAULT_LANGUAGE = (os.getenv('LANG') or 'en_US').replace('-', '_').split('.', 1)[0]
 
+CHUNK_SIZE = 1 << 18
+PROGRESS_INTERVAL = 0.1 # seconds between progress updates
+MAX_DOWNLOADS = 8
+MAX_LISTINGS = 8
+MAX_CONNECTIONS = 64
+LIST_ALPHABET = string.ascii_letters + string.digits + '_-'
+LIST_GAP_PAGE_SIZE = 10 # keys per page when probing for keys outside LIST_ALPHABET
+CACHE_DIR = os.path.join(os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'circdown')
+LIST_CACHE_TTL = 60 * 60 # seconds to trust cached board/language listings
+SIZE_UNITS = ('KB', 'MB', 'GB', 'TB', 'PB', 'EB', 'ZB', 'YB')
+
+def format_size(num_bytes, keep_width=False):
+    "Format a byte count with decimal units, e.g. '4.19 MB'"
+    if num_bytes == 1:
+        return '1 byte'
+
+    for exponent, symbol in reversed(list(enumerate(SIZE_UNITS, 1))):
+        divider = 1000 ** exponent
+        if num_bytes >= divider:
+            text = '%.2f' % (num_bytes / divider)
+            if not keep_width:
+                text = text.rstrip('0').rstrip('.')
+            return f'{text} {symbol}'
+
+    return f'{num_bytes} bytes'
+
 class ImageInfo:
-    __slots__ = ('name', 'url', 'size', 'mdate', 'board', 'language', 'version', 'type')
+    __slots__ = ('name', 'url', 'size', 'mdate', 'board', 'language', 'version', 'type',
+                 '_is_release', '_is_full_release', '_is_rc', '_is_alpha')
 
     RELEASE_REGEX = re.compile(r'^[0-9]+(?:\.[0-9]+)+')
     FULL_RELEASE_REGEX = re.compile(r'^[0-9]+(?:\.[0-9]+)*$')
-    FILETYPE_REGEX = re.compile(r'^(.*?)((?:\.[A-Za-z][0-9A-Za-z]*)+)$')
 
     @property
     def is_rc(self):
-        return 'rc' in self.version
+        return self._is_rc
 
     @property
     def is_alpha(self):
-        return 'alpha' in self.version
+        return self._is_alpha
 
     @property
     def is_release(self):
-        return self.RELEASE_REGEX.match(self.version)
+        return self._is_release
 
     @property
     def is_full_release(self):
-        return self.FULL_RELEASE_REGEX.match(self.version)
+        return self._is_full_release
 
     @property
     def human_size(self):
-        return humanfriendly.format_size(self.size)
+        return format_size(self.size)
 
     def __str__(self):
         return f'{self.board} ({self.type}) - {self.language} - Version {self.version} - {self.human_size} - Modified {self.mdate:%Y-%m-%d %H:%M}'
@@ -54,55 +96,359 @@ class ImageInfo:
 
     @classmethod
     def from_url(cls, url, size=None, mdate=None):
-        info = requests.compat.urlparse(url)
-        result = cls()
-        result.url = url
-        result.size = size
-        result.mdate = mdate
-        result.name = filename = info.path.split('/')[-1]
-        name, result.type = cls.FILETYPE_REGEX.match(filename).groups()
-        _, _, result.board, result.language, result.version = name.split('-', 4)
+        result, = cls.from_url_many([(url, size, mdate)])
         return result
 
+    @classmethod
+    def from_url_many(cls, records):
+        "Yield an ImageInfo for each (url, size, mdate) record, binding the per-image lookups once for the whole batch"
+        new = cls.__new__
+        split_filetype = _split_filetype
+        release_match = cls.RELEASE_REGEX.match
+        full_release_match = cls.FULL_RELEASE_REGEX.match
+
+        for url, size, mdate in records:
+            result = new(cls)
+            result.url = url
+            result.size = size
+            result.mdate = mdate
+            result.name = filename = url.rsplit('/', 1)[-1]
+            name, result.type = split_filetype(filename)
+            _, _, result.board, result.language, version = name.split('-', 4)
+            result.version = version
+            result._is_release = release_match(version) is not None
+            result._is_full_release = full_release_match(version) is not None
+            result._is_rc = 'rc' in version
+            result._is_alpha = 'alpha' in version
+            yield result
+
+def _split_filetype(filename):
+    "Split a filename into its stem and its (possibly compound) extension, e.g. ('name-1.0', '.combined.bin')"
+    parts = filename.split('.')
+    stem = len(parts)
+
+    # an extension part starts with a letter and is otherwise alphanumeric
+    while stem > 1:
+        part = parts[stem - 1]
+        if not (part.isascii() and part.isalnum() and part[0].isalpha()):
+            break
+        stem -= 1
+
+    if stem == len(parts):
+        raise ValueError(f'no file extension in {filename!r}')
+
+    return '.'.join(parts[:stem]), '.' + '.'.join(parts[stem:])
+
+def _parse_s3_ts(text):
+    "Parse an S3 timestamp, e.g. '2021-01-01T12:34:56.000Z'"
+    if ciso8601 is not None:
+        return ciso8601.parse_datetime(text)
+
+    # S3 always uses this fixed-width UTC form; slicing it is much faster than strptime
+    if len(text) > 20 and text[19] == '.' and text[-1] == 'Z':
+        return datetime.datetime(
+            int(text[0:4]), int(text[5:7]), int(text[8:10]),
+            int(text[11:13]), int(text[14:16]), int(text[17:19]),
+            int(text[20:-1].ljust(6, '0')[:6]),
+            tzinfo=datetime.timezone.utc,
+        )
+
+    return datetime.datetime.strptime(text, '%Y-%m-%dT%H:%M:%S.%f%z')
+
 class S3:
     "Helper for navigating the S3 bucket"
-    def __init__(self, bucket_url):
-        self._bucket_url = bucket_url
-        self._session = requests.Session()
 
-    def list(self, path, *, delimiter='/', marker=None):
-        rsp = self._session.get(self._bucket_url, params=dict(
-            prefix=path, delimiter=delimiter, marker=marker
-        ))
+    NAMESPACE = '{http://s3.amazonaws.com/doc/2006-03-01/}'
+
+    CONTENTS = NAMESPACE + 'Contents'
+    COMMON_PREFIXES = NAMESPACE + 'CommonPrefixes'
+    KEY = NAMESPACE + 'Key'
+    SIZE = NAMESPACE + 'Size'
+    LAST_MODIFIED = NAMESPACE + 'LastModified'
+    PREFIX = NAMESPACE + 'Prefix'
+    IS_TRUNCATED = NAMESPACE + 'IsTruncated'
+    NEXT_MARKER = NAMESPACE + 'NextMarker'
+
+    LISTING_TAGS = frozenset((CONTENTS, COMMON_PREFIXES, IS_TRUNCATED, NEXT_MARKER))
+
+    # sorts after any realistic key sharing the same prefix
+    KEY_MAX = '\U0010ffff'
+
+    def __init__(self, bucket_url, *, max_connections=MAX_CONNECTIONS, cache_dir=CACHE_DIR):
+        self._bucket_url = bucket_url.rstrip('/')
+        self._max_connections = max_connections
+        self._cache_dir = cache_dir
+        self._session_instance = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def _session(self):
+        # created on first use, so listings served from the cache never import requests
+        if self._session_instance is None:
+            with self._session_lock:
+                if self._session_instance is None:
+                    import requests
+
+                    session = requests.Session()
+
+                    # listings are highly compressible XML; ask for gzip explicitly and
+                    # let urllib3 decompress the stream incrementally as it is parsed
+                    session.headers['Accept-Encoding'] = 'gzip'
+
+                    # every request goes to the bucket host, so a few host pools suffice;
+                    # size each one so concurrent listings and downloads keep their connections alive
+                    adapter = requests.adapters.HTTPAdapter(
+                        pool_connections=4, pool_maxsize=self._max_connections
+                    )
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+
+                    self._session_instance = session
 
+        return self._session_instance
+
+    def _cache_path(self, *key):
+        if self._cache_dir is None:
+            return None
+
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+        except OSError:
+            return None
+
+        digest = hashlib.sha1(repr((self._bucket_url, *key)).encode()).hexdigest()
+        return os.path.join(self._cache_dir, digest + '.xml')
+
+    def _parse_listing(self, source):
         # ET.register_namespace('aws', 'http://s3.amazonaws.com/doc/2006-03-01/')
-        return ET.fromstring(rsp.content)
+        for _, elem in ET.iterparse(source, events=('end',)):
+            if elem.tag in self.LISTING_TAGS:
+                yield elem
+
+                # discard parsed elements so the tree stays small
+                elem.clear()
+
+                if hasattr(elem, 'getprevious'):
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
 
-class FirmwareDownloader(S3):
-    def __init__(self, bucket_url="https://adafruit-circuit-python.s3.amazonaws.com"):
-        super().__init__(bucket_url)
+    def list(self, path, *, delimiter='/', marker=None, max_keys=None, max_age=0):
+        """Yield the top-level elements of one page of a listing as they are parsed
+
+        Listings are cached on disk; a cached page younger than max_age seconds
+        is used without contacting S3, otherwise it is revalidated by ETag.
+        Pages with neither a max_age nor an ETag are not cached.
+        """
+        cache = self._cache_path(path, delimiter, marker, max_keys)
+        etag = None
+
+        if cache and os.path.exists(cache):
+            if max_age and time.time() - os.path.getmtime(cache) < max_age:
+                with open(cache, 'rb') as fh:
+                    yield from self._parse_listing(fh)
+                return
+
+            if os.path.exists(cache + '.etag'):
+                with open(cache + '.etag') as fh:
+                    etag = fh.read()
+
+        with self._session.get(self._bucket_url, stream=True, params=dict(
+            prefix=path, delimiter=delimiter, marker=marker, **{'max-keys': max_keys}
+        ), headers={'If-None-Match': etag} if etag else None) as rsp:
+            if rsp.status_code == 304:
+                os.utime(cache)
+
+                with open(cache, 'rb') as fh:
+                    yield from self._parse_listing(fh)
+                return
+
+            rsp.raise_for_status()
+            rsp.raw.decode_content = True
+
+            # without a TTL the page can only be reused by revalidating its ETag,
+            # so there is no point caching it if S3 didn't send one
+            if cache is None or not (max_age or 'ETag' in rsp.headers):
+                yield from self._parse_listing(rsp.raw)
+                return
+
+            # save the body to the cache as it is parsed, under a name unique to
+            # this request so concurrent listings of the same page don't collide
+            fd, temp = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+
+            try:
+                with open(fd, 'wb') as fh:
+                    try:
+                        yield from self._parse_listing(_TeeReader(rsp.raw, fh))
+                    except GeneratorExit:
+                        # the consumer stopped early; save the rest of the page so it is still cached
+                        shutil.copyfileobj(rsp.raw, fh)
+
+                os.replace(temp, cache)
+
+            except BaseException:
+                os.remove(temp)
+                raise
+
+            if 'ETag' in rsp.headers:
+                with open(cache + '.etag', 'w') as fh:
+                    fh.write(rsp.headers['ETag'])
+
+            elif os.path.exists(cache + '.etag'):
+                os.remove(cache + '.etag')
+
+    def _element_name(self, elem):
+        return elem.findtext(self.KEY) or elem.findtext(self.PREFIX)
+
+    def iter_list(self, path, *, delimiter='/', marker=None, max_keys=None, max_age=0):
+        "Yield the top-level elements of every page of a listing, following the marker until it is no longer truncated"
+        while True:
+            truncated = False
+            next_marker = last = None
+
+            for elem in self.list(path, delimiter=delimiter, marker=marker, max_keys=max_keys, max_age=max_age):
+                if elem.tag == self.IS_TRUNCATED:
+                    truncated = elem.text == 'true'
+
+                elif elem.tag == self.NEXT_MARKER:
+                    next_marker = elem.text
+
+                else:
+                    last = self._element_name(elem)
+                    yield elem
+
+            if not truncated:
+                return
+
+            marker = next_marker or last
+
+    def _list_range(self, path, start, stop, *, delimiter='/', max_keys=None, max_age=0):
+        # yield the elements after start and before stop (or to the end if stop is None)
+        for elem in self.iter_list(path, delimiter=delimiter, marker=start, max_keys=max_keys, max_age=max_age):
+            if stop is not None and self._element_name(elem) >= stop:
+                return
+
+            yield elem
+
+    def list_parallel(self, path, parse, *, delimiter='/', max_age=0, alphabet=LIST_ALPHABET):
+        """Yield the parsed results of a listing, listing it in concurrent partitions if it spans several pages
+
+        Keys continuing with a character of alphabet are listed with that
+        character added to the prefix, so S3 filters each partition itself.
+        The gaps between those prefixes are listed as marker ranges with small
+        pages, so keys starting with any other character are not lost.
+        """
+        first = dict(truncated=False, last=None)
+
+        def first_page():
+            for elem in self.list(path, delimiter=delimiter, max_age=max_age):
+                if elem.tag == self.IS_TRUNCATED:
+                    first['truncated'] = elem.text == 'true'
+
+                elif elem.tag != self.NEXT_MARKER:
+                    first['last'] = self._element_name(elem)
+
+                yield elem
 
-    def parse_contents(self, doc):
-        for cont in doc.findall('.//{*}Contents'):
-            yield (
-                requests.compat.urljoin(self._bucket_url, cont.find('{*}Key').text),
-                int(cont.find('{*}Size').text),
-                datetime.datetime.strptime(cont.find('{*}LastModified').text, '%Y-%m-%dT%H:%M:%S.%f%z'),
-            )
+        yield from list(parse(first_page()))
 
-    def parse_common_prefixes(self, doc):
-        for cont in doc.findall('.//{*}CommonPrefixes'):
-            yield requests.compat.urljoin(self._bucket_url, cont.find('{*}Prefix').text)
+        if not first['truncated']:
+            return
 
-    def list_boards(self, search=None):
-        boards = super().list(f'bin/')
+        # (prefix, start marker, end bound, page size) for each partition, in S3 key order
+        chars = sorted(set(alphabet))
+        partitions = [(path, None, path + chars[0], LIST_GAP_PAGE_SIZE)]
 
-        for key in self.parse_common_prefixes(boards):
+        for ch, following in zip(chars, chars[1:] + [None]):
+            end = path + ch + self.KEY_MAX
+            partitions.append((path + ch, None, end, None))
+
+            if following is None:
+                partitions.append((path, end, None, None))
+
+            elif ord(following) != ord(ch) + 1:
+                partitions.append((path, end, path + following, LIST_GAP_PAGE_SIZE))
+
+        # the first page already covers everything up to its last key
+        last = first['last']
+        partitions = [
+            (prefix, max(start or last, last), stop, max_keys)
+            for prefix, start, stop, max_keys in partitions
+            if stop is None or stop > last
+        ]
+
+        def list_partition(partition):
+            prefix, start, stop, max_keys = partition
+            return list(parse(self._list_range(
+                prefix, start, stop, delimiter=delimiter, max_keys=max_keys, max_age=max_age
+            )))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._max_connections) as pool:
+            for results in pool.map(list_partition, partitions):
+                yield from results
+
+def _preallocate(fd, size):
+    if size <= 0:
+        return
+
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass
+
+    os.ftruncate(fd, size)
+
+def _write_all(fd, data):
+    view = memoryview(data)
+
+    while view:
+        view = view[os.write(fd, view):]
+
+class _TeeReader:
+    "File-like wrapper that copies everything read from a stream into another file"
+    def __init__(self, source, sink):
+        self._source = source
+        self._sink = sink
+
+    def read(self, size=-1):
+        data = self._source.read(size)
+        self._sink.write(data)
+        return data
+
+class FirmwareDownloader(S3):
+    def __init__(self, bucket_url="https://adafruit-circuit-python.s3.amazonaws.com", **kwargs):
+        super().__init__(bucket_url, **kwargs)
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_LISTINGS)
+
+    def parse_contents(self, elems):
+        for cont in elems:
+            if cont.tag == self.CONTENTS:
+                yield (
+                    f'{self._bucket_url}/{cont.findtext(self.KEY).lstrip("/")}',
+                    int(cont.findtext(self.SIZE)),
+                    _parse_s3_ts(cont.findtext(self.LAST_MODIFIED)),
+                )
+
+    def parse_common_prefixes(self, elems):
+        for cont in elems:
+            if cont.tag == self.COMMON_PREFIXES:
+                yield f'{self._bucket_url}/{cont.findtext(self.PREFIX).lstrip("/")}'
+
+    def list_boards(self, search=None, *, prefix=False):
+        if prefix and search:
+            # let S3 filter on the leading characters instead of listing every board
+            boards = self.parse_common_prefixes(super().iter_list(f'bin/{search}', max_age=LIST_CACHE_TTL))
+        else:
+            boards = super().list_parallel(f'bin/', self.parse_common_prefixes, max_age=LIST_CACHE_TTL)
+
+        for key in boards:
             if search is None or search in key:
                 yield key.split('/')[-2]
 
-    def list_languages(self, board, search=None):
-        languages = super().list(f'bin/{board}/')
+    def list_languages(self, board, search=None, *, prefix=False):
+        path = f'bin/{board}/{search}' if prefix and search else f'bin/{board}/'
+        languages = super().iter_list(path, max_age=LIST_CACHE_TTL)
 
         for key in self.parse_common_prefixes(languages):
             if search is None or search in key:
@@ -115,120 +461,229 @@ class FirmwareDownloader(S3):
                     yield image.version
 
     def list_images(self, board, language):
-        images = super().list(f'bin/{board}/{language}/')
+        images = super().iter_list(f'bin/{board}/{language}/')
 
-        return [
-            ImageInfo.from_url(key, size, date)
-            for key, size, date in self.parse_contents(images)
-        ]
+        return ImageInfo.from_url_many(self.parse_contents(images))
+
+    def list_images_many(self, targets):
+        "List the images for several (board, language) pairs concurrently, returning a list per pair in order"
+        return self._pool.map(lambda target: list(self.list_images(*target)), targets)
+
+    def download(self, image, *, progress=True):
+        """Download an image, skipping it if already complete and resuming a partial download
 
-    def download(self, image):
-        with self._session.get(image.url, stream=True) as rsp:
-            with open(image.name, 'wb') as fh:
-                progress = 0
+        Data is written to '<name>.part', which is renamed to the image's name
+        only once the whole body has arrived.
+        """
+        if image.size is not None and os.path.isfile(image.name) and os.path.getsize(image.name) == image.size:
+            if progress:
+                print('%12s (already downloaded)' % format_size(image.size, True))
+            return
 
-                for chunk in rsp.iter_content(1<<15):
-                    fh.write(chunk)
-                    progress += len(chunk)
+        part = image.name + '.part'
 
-                    print('\r%12s' % humanfriendly.format_size(progress, True), end='', flush=True)
+        try:
+            existing = os.path.getsize(part)
+        except OSError:
+            existing = 0
 
-                print()
+        # a full-length part file may be preallocated space from a killed download,
+        # so its contents can't be trusted; start over
+        if image.size is not None and existing >= image.size:
+            existing = 0
 
-def main(args=None):
-    parser = argparse.ArgumentParser()
-    commands = parser.add_subparsers(title='Commands', dest='command')
+        headers = None
 
-    list_command = commands.add_parser('list')
+        if existing:
+            headers = {'Range': f'bytes={existing}-'}
 
-    list_type = list_command.add_subparsers(dest='list_type', required=True)
+            # only resume if the object hasn't been replaced since it was listed
+            if image.mdate is not None:
+                headers['If-Range'] = email.utils.format_datetime(
+                    image.mdate.astimezone(datetime.timezone.utc), usegmt=True
+                )
 
-    list_boards = list_type.add_parser('boards', aliases=['board'])
-    list_boards.set_defaults(list_type='boards')
-    list_boards.add_argument('search', nargs='?')
+        with self._session.get(image.url, stream=True, headers=headers) as rsp:
+            rsp.raise_for_status()
 
-    list_langs = list_type.add_parser('languages', aliases=['lang', 'langs'])
-    list_langs.set_defaults(list_type='languages')
-    list_langs.add_argument('board')
-    list_langs.add_argument('search', nargs='?')
+            # only append if the server actually sent the requested range
+            if existing and not (rsp.status_code == 206 and
+                                 rsp.headers.get('Content-Range', '').startswith(f'bytes {existing}-')):
+                existing = 0
 
-    list_versions = list_type.add_parser('versions', aliases=['ver', 'vers'])
-    list_versions.set_defaults(list_type='versions')
-    list_versions.add_argument('board')
-    list_versions.add_argument('language', nargs='?', default=DEFAULT_LANGUAGE)
-    list_versions.add_argument('search', nargs='?')
+            fd = os.open(part, os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+            received = existing
 
-    get_command = commands.add_parser('get')
-    get_command.add_argument('board')
-    get_command.add_argument('--language', '-L', default=DEFAULT_LANGUAGE)
-    get_command.add_argument('--version', '-V')
-    get_command.add_argument('--type', '-T')
+            try:
+                # reserve the whole file up front to avoid fragmenting it as it grows
+                _preallocate(fd, existing + int(rsp.headers.get('Content-Length', 0)))
+                os.lseek(fd, existing, os.SEEK_SET)
 
-    get_command.add_argument('--prerelease', action='store_true')
-    get_command.add_argument('--latest', action='store_true')
+                last_report = time.monotonic()
 
-    options = parser.parse_args(args)
+                for chunk in rsp.iter_content(CHUNK_SIZE):
+                    _write_all(fd, chunk)
+                    received += len(chunk)
 
-    print(options)
+                    if progress:
+                        now = time.monotonic()
 
-    cp = FirmwareDownloader()
+                        if now - last_report > PROGRESS_INTERVAL:
+                            last_report = now
+                            sys.stdout.write('\r%12s' % format_size(received, True))
+                            sys.stdout.flush()
 
-    if options.command == 'list':
+            finally:
+                # drop the preallocated tail beyond what actually arrived, so an
+                # interrupted download never leaves a full-length, zero-filled file;
+                # this also covers a body shorter than Content-Length or the stale file
+                try:
+                    os.ftruncate(fd, received)
+                finally:
+                    os.close(fd)
 
-        if options.list_type == 'boards':
-            print(f'Boards containing "{options.search}":'
-                  if options.search else 'Boards')
+            if image.size is not None and received != image.size:
+                raise OSError(f'incomplete download of {image.name}: received {received} of {image.size} bytes')
 
-            for key in cp.list_boards(options.search):
-                print('\t', key)
+            os.replace(part, image.name)
 
-        elif options.list_type == 'languages':
-            print(f'Languages for {options.board} containing "{options.search}":'
-                  if options.search else f'Languages for {options.board}:')
+            if progress:
+                print('\r%12s' % format_size(received, True))
 
-            for key in cp.list_languages(options.board, options.search):
-                print('\t', key)
+    def download_many(self, images, *, max_workers=MAX_DOWNLOADS):
+        "Download several images concurrently, yielding each one as it completes"
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(self.download, image, progress=False): image
+                for image in images
+            }
 
-        elif options.list_type == 'versions':
-            print(f'Versions for {options.board} ({options.language}) containing "{options.search}":'
-                  if options.search else f'Versions for {options.board} ({options.language}):')
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+                yield futures[future]
 
-            for key in cp.list_versions(options.board, options.language, options.search):
-                print('\t', key)
+def list_boards_command(cp, options):
+    match = 'starting with' if options.prefix else 'containing'
+    print(f'Boards {match} "{options.search}":'
+          if options.search else 'Boards')
 
-        else:
-            print("Nothing to do!")
+    for key in cp.list_boards(options.search, prefix=options.prefix):
+        print('\t', key)
 
-    elif options.command == 'get':
+def list_languages_command(cp, options):
+    match = 'starting with' if options.prefix else 'containing'
+    print(f'Languages for {options.board} {match} "{options.search}":'
+          if options.search else f'Languages for {options.board}:')
 
-        if options.type and not options.type.startswith('.'):
-            options.type = '.' + options.type
+    for key in cp.list_languages(options.board, options.search, prefix=options.prefix):
+        print('\t', key)
 
-        results = sorted(cp.list_images(options.board, options.language), key=lambda r: (r.mdate.date(), r.version), reverse=True)
+def list_versions_command(cp, options):
+    print(f'Versions for {options.board} ({options.language}) containing "{options.search}":'
+          if options.search else f'Versions for {options.board} ({options.language}):')
 
-        results = sorted(results, key=lambda r: r.type, reverse=True)
-        results = sorted(results, key=lambda r: r.mdate.date(), reverse=True)
+    for key in cp.list_versions(options.board, options.language, options.search):
+        print('\t', key)
 
-        filtered = [img for img in results
-            if options.type is None or img.type.endswith(options.type)
-            if options.version is None or img.version == options.version
-            if options.prerelease or img.is_full_release or
-               options.latest or img.is_release
-        ]
+def get_command(cp, options):
+    if options.type and not options.type.startswith('.'):
+        options.type = '.' + options.type
+
+    selected = []
 
-        if filtered:
-            selected = filtered[0]
+    # drop repeated boards/languages so the same image is never listed or written twice at once
+    targets = list(dict.fromkeys((board, language)
+        for board in options.board
+        for language in options.language or [DEFAULT_LANGUAGE]
+    ))
 
-            print(selected)
-            print('\t', selected.url)
+    any_release = options.prerelease or options.latest
+
+    for (board, language), results in zip(targets, cp.list_images_many(targets)):
+        results.sort(key=lambda r: (r.mdate.date(), r.type, r.version), reverse=True)
+
+        # results are sorted best-first, so stop at the first match
+        image = next((img for img in results
+            if options.version is None or img.version == options.version
+            if any_release or img.is_full_release or img.is_release
+            if options.type is None or img.type.endswith(options.type)
+        ), None)
+
+        if image is not None:
+            print(image)
+            print('\t', image.url)
             print()
 
-            print(f'Downloading "{selected.name}" ({selected.human_size})...')
-            cp.download(selected)
-            print(f'Finished.')
+            selected.append(image)
 
         else:
-            print('No images found that match the specified board, language, and/or version.')
+            print(f'No images found for {board} ({language}) that match the specified version and/or type.')
+
+    if len(selected) == 1:
+        image, = selected
+
+        print(f'Downloading "{image.name}" ({image.human_size})...')
+        cp.download(image)
+        print(f'Finished.')
+
+    elif selected:
+        print(f'Downloading {len(selected)} images...')
+
+        for image in cp.download_many(selected):
+            print('\t', image.name)
+
+        print(f'Finished.')
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--no-cache', dest='cache_dir', action='store_const', const=None, default=CACHE_DIR,
+                        help='always fetch listings from S3 instead of using the local cache')
+    parser.set_defaults(func=None)
+    commands = parser.add_subparsers(title='Commands', dest='command')
+
+    list_command = commands.add_parser('list')
+
+    list_type = list_command.add_subparsers(dest='list_type', required=True)
+
+    list_boards = list_type.add_parser('boards', aliases=['board'])
+    list_boards.set_defaults(list_type='boards', func=list_boards_command)
+    list_boards.add_argument('search', nargs='?')
+    list_boards.add_argument('--prefix', '-p', action='store_true',
+                             help='only match boards whose names start with the search text')
+
+    list_langs = list_type.add_parser('languages', aliases=['lang', 'langs'])
+    list_langs.set_defaults(list_type='languages', func=list_languages_command)
+    list_langs.add_argument('board')
+    list_langs.add_argument('search', nargs='?')
+    list_langs.add_argument('--prefix', '-p', action='store_true',
+                            help='only match languages whose names start with the search text')
+
+    list_versions = list_type.add_parser('versions', aliases=['ver', 'vers'])
+    list_versions.set_defaults(list_type='versions', func=list_versions_command)
+    list_versions.add_argument('board')
+    list_versions.add_argument('language', nargs='?', default=DEFAULT_LANGUAGE)
+    list_versions.add_argument('search', nargs='?')
+
+    get_parser = commands.add_parser('get')
+    get_parser.set_defaults(func=get_command)
+    get_parser.add_argument('board', nargs='+')
+    get_parser.add_argument('--language', '-L', action='append')
+    get_parser.add_argument('--version', '-V')
+    get_parser.add_argument('--type', '-T')
+
+    get_parser.add_argument('--prerelease', action='store_true')
+    get_parser.add_argument('--latest', action='store_true')
+
+    options = parser.parse_args(args)
+
+    print(options)
+
+    if options.func is None:
+        print("Nothing to do!")
+        return
+
+    cp = FirmwareDownloader(cache_dir=options.cache_dir)
+    options.func(cp, options)
 
 if __name__ == '__main__':
     main()